@@ -65,7 +65,7 @@ setup(
         "pandas",
         "Pillow",
         "tabulate",
-        "tensorflow>=2.4",
+        "tensorflow>=2.5",
         "tensorflow-datasets>=4.2",
         "tqdm",
         "umap-learn",
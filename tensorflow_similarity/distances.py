@@ -13,7 +13,7 @@
 # limitations under the License.
 """Vectorized embedding pairwise distances computation functions"""
 from abc import ABC, abstractmethod
-from typing import Union, List
+from typing import Optional, Tuple, Union, List
 
 import tensorflow as tf
 
@@ -25,10 +25,22 @@ class Distance(ABC):
     Note: don't forget to add your distance to the DISTANCES list
     and add alias names in it.
 
+    Args:
+        name: Distance canonical name.
+
+        aliases: Alternative names the distance can be requested by.
+
+        compute_dtype: Optional dtype, e.g. `'bfloat16'`, used to compute the
+        pairwise embeddings matmul. The result is cast back to the embeddings
+        dtype. Defaults to None which computes it in the embeddings dtype.
     """
-    def __init__(self, name: str, aliases: List[str] = []):
+    def __init__(self,
+                 name: str,
+                 aliases: List[str] = [],
+                 compute_dtype: Optional[str] = None):
         self.name = name
         self.aliases = aliases
+        self.compute_dtype = compute_dtype
 
     @abstractmethod
     def call(self, embeddings: FloatTensor) -> FloatTensor:
@@ -47,8 +59,47 @@ class Distance(ABC):
     def __str__(self) -> str:
         return self.name
 
+    def __eq__(self, other: object) -> bool:
+        # tf.function caches each instance's bound call by equality, so equal
+        # distances must be guaranteed to compute the same thing.
+        return type(self) is type(other) and vars(self) == vars(other)
+
+    def __hash__(self) -> int:
+        return hash(self.name)
+
     def get_config(self):
-        return {}
+        return {'compute_dtype': self.compute_dtype}
+
+    def _pairwise_matmul(self, embeddings: FloatTensor) -> FloatTensor:
+        """Compute the embeddings gram matrix in `compute_dtype`."""
+        if self.compute_dtype is None:
+            gram: FloatTensor = tf.linalg.matmul(embeddings,
+                                                 embeddings,
+                                                 transpose_b=True)
+            return gram
+
+        x = tf.cast(embeddings, self.compute_dtype)
+        gram = tf.linalg.matmul(x, x, transpose_b=True)
+        result: FloatTensor = tf.cast(gram, embeddings.dtype)
+        return result
+
+    def _pairwise_sq(
+            self, embeddings: FloatTensor) -> Tuple[FloatTensor, FloatTensor]:
+        """Compute the gram matrix and the halved squared norms.
+
+        The pairwise squared distances are then
+        `2 * (half_sqnorm + half_sqnorm^T - gram)`.
+        """
+        gram = self._pairwise_matmul(embeddings)
+        if self.compute_dtype is None:
+            half_sqnorm = 0.5 * tf.math.reduce_sum(
+                embeddings * embeddings, axis=1, keepdims=True)
+        else:
+            # take the norms from the reduced precision gram so they carry
+            # the same rounding and cancel exactly on the diagonal.
+            half_sqnorm = 0.5 * tf.expand_dims(tf.linalg.diag_part(gram),
+                                               axis=1)
+        return gram, half_sqnorm
 
 
 @tf.keras.utils.register_keras_serializable(package="Similarity")
@@ -64,11 +115,11 @@ class InnerProductSimilarity(Distance):
     margin in many of the losses. This is likely meant to be used with custom
     loss functions that expect a similarity instead of a distance.
     """
-    def __init__(self):
+    def __init__(self, compute_dtype: Optional[str] = None):
         "Init Inner product similarity"
-        super().__init__('inner_product', ['ip'])
+        super().__init__('inner_product', ['ip'], compute_dtype=compute_dtype)
 
-    @tf.function
+    @tf.function(jit_compile=True, experimental_relax_shapes=True)
     def call(self, embeddings: FloatTensor) -> FloatTensor:
         """Compute pairwise similarities for a given batch of embeddings.
 
@@ -79,7 +130,7 @@ class InnerProductSimilarity(Distance):
             FloatTensor: Pairwise distance tensor.
         """
 
-        tensor = tf.linalg.matmul(embeddings, embeddings, transpose_b=True)
+        tensor = self._pairwise_matmul(embeddings)
         sims: FloatTensor = tf.reduce_sum(tensor, axis=1, keepdims=True)
         return sims
 
@@ -91,11 +142,11 @@ class CosineDistance(Distance):
     The [Cosine Distance](https://en.wikipedia.org/wiki/Cosine_similarity) is
     an angular distance that varies from 0 (similar) to 1 (dissimilar).
     """
-    def __init__(self):
+    def __init__(self, compute_dtype: Optional[str] = None):
         "Init Cosine distance"
-        super().__init__('cosine')
+        super().__init__('cosine', compute_dtype=compute_dtype)
 
-    @tf.function
+    @tf.function(jit_compile=True, experimental_relax_shapes=True)
     def call(self, embeddings: FloatTensor) -> FloatTensor:
         """Compute pairwise distances for a given batch of embeddings.
 
@@ -105,8 +156,7 @@ class CosineDistance(Distance):
         Returns:
             FloatTensor: Pairwise distance tensor.
         """
-        distances = 1 - tf.linalg.matmul(
-                embeddings, embeddings, transpose_b=True)
+        distances = 1 - self._pairwise_matmul(embeddings)
         min_clip_distances: FloatTensor = tf.math.maximum(distances, 0.0)
         return min_clip_distances
 
@@ -122,11 +172,12 @@ class EuclideanDistance(Distance):
 
     **Alias**: L2 Norm, Pythagorean
     """
-    def __init__(self):
+    def __init__(self, compute_dtype: Optional[str] = None):
         "Init Euclidean distance"
-        super().__init__('euclidean', ['l2', 'pythagorean'])
+        super().__init__('euclidean', ['l2', 'pythagorean'],
+                         compute_dtype=compute_dtype)
 
-    @tf.function
+    @tf.function(jit_compile=True, experimental_relax_shapes=True)
     def call(self, embeddings: FloatTensor) -> FloatTensor:
         """Compute pairwise distances for a given batch of embeddings.
 
@@ -136,20 +187,19 @@ class EuclideanDistance(Distance):
         Returns:
             FloatTensor: Pairwise distance tensor.
         """
-        squared_norm = tf.math.square(embeddings)
-        squared_norm = tf.math.reduce_sum(squared_norm, axis=1, keepdims=True)
-
-        distances: FloatTensor = 2.0 * tf.linalg.matmul(
-            embeddings, embeddings, transpose_b=True)
-        distances = squared_norm - distances + tf.transpose(squared_norm)
+        gram, half_sqnorm = self._pairwise_sq(embeddings)
+        distances: FloatTensor = 2.0 * (
+            half_sqnorm + tf.transpose(half_sqnorm) - gram)
 
         # Avoid NaN and inf gradients when back propagating through the sqrt.
         # values smaller than 1e-18 produce inf for the gradient, and 0.0
         # produces NaN. All values smaller than 1e-13 should produce a gradient
         # of 1.0.
+        # Expressed as a single select so XLA can fuse it with the matmul
+        # epilogue instead of materializing a separate float mask.
         dist_mask = tf.math.greater_equal(distances, 1e-18)
-        distances = tf.math.maximum(distances, 1e-18)
-        distances = tf.math.sqrt(distances) * tf.cast(dist_mask, tf.float32)
+        distances = tf.where(
+            dist_mask, tf.math.sqrt(tf.math.maximum(distances, 1e-18)), 0.0)
 
         return distances
 
@@ -161,10 +211,11 @@ class SquaredEuclideanDistance(Distance):
     The [Sequared Euclidean Distance](https://en.wikipedia.org/wiki/Euclidean_distance#Squared_Euclidean_distance) is
     a distance that varies from 0 (similar) to infinity (dissimilar).
     """
-    def __init__(self):
-        super().__init__('squared_euclidean', ['sql2', 'sqeuclidean'])
+    def __init__(self, compute_dtype: Optional[str] = None):
+        super().__init__('squared_euclidean', ['sql2', 'sqeuclidean'],
+                         compute_dtype=compute_dtype)
 
-    @tf.function
+    @tf.function(jit_compile=True, experimental_relax_shapes=True)
     def call(self, embeddings: FloatTensor) -> FloatTensor:
         """Compute pairwise distances for a given batch of embeddings.
 
@@ -174,17 +225,35 @@ class SquaredEuclideanDistance(Distance):
         Returns:
             FloatTensor: Pairwise distance tensor.
         """
-        squared_norm = tf.math.square(embeddings)
-        squared_norm = tf.math.reduce_sum(squared_norm, axis=1, keepdims=True)
-
-        distances: FloatTensor = 2.0 * tf.linalg.matmul(
-            embeddings, embeddings, transpose_b=True)
-        distances = squared_norm - distances + tf.transpose(squared_norm)
+        gram, half_sqnorm = self._pairwise_sq(embeddings)
+        distances: FloatTensor = 2.0 * (
+            half_sqnorm + tf.transpose(half_sqnorm) - gram)
         distances = tf.math.maximum(distances, 0.0)
 
         return distances
 
 
+@tf.custom_gradient
+def _manhattan_block(block: FloatTensor, embeddings: FloatTensor):
+    """Manhattan distances between a block of rows and all the embeddings.
+
+    The gradient recomputes the block deltas instead of keeping them, so
+    back-propagating through the blocks also stays at `[block_size, N, D]`.
+    """
+    deltas = tf.expand_dims(block, axis=1) - tf.expand_dims(embeddings, axis=0)
+    block_dists = tf.math.reduce_sum(tf.math.abs(deltas), axis=2)
+
+    def grad(upstream: FloatTensor) -> Tuple[FloatTensor, FloatTensor]:
+        signs = tf.math.sign(
+            tf.expand_dims(block, axis=1) - tf.expand_dims(embeddings, axis=0))
+        signs = signs * tf.expand_dims(upstream, axis=2)
+        block_grad: FloatTensor = tf.math.reduce_sum(signs, axis=1)
+        embeddings_grad: FloatTensor = -tf.math.reduce_sum(signs, axis=0)
+        return block_grad, embeddings_grad
+
+    return block_dists, grad
+
+
 @tf.keras.utils.register_keras_serializable(package="Similarity")
 class ManhattanDistance(Distance):
     """Compute pairwise Manhattan distances between embeddings.
@@ -193,12 +262,17 @@ class ManhattanDistance(Distance):
     is the sum of the lengths of the projections of the line segment between
     two embeddings onto the Cartesian axes. The larger the distance the more
     dissimilar the embeddings are.
+
+    The pairwise deltas are computed over blocks of `block_size` rows, and
+    recomputed per block when back-propagating, so the peak memory is
+    `[block_size, N, D]` instead of `[N, N, D]` for inference and training.
     """
-    def __init__(self):
+    def __init__(self, block_size: int = 64):
         "Init Manhattan distance"
         super().__init__('manhattan', ['l1', 'taxicab'])
+        self.block_size = block_size
 
-    @tf.function
+    @tf.function(experimental_relax_shapes=True)
     def call(self, embeddings: FloatTensor) -> FloatTensor:
         """Compute pairwise distances for a given batch of embeddings.
 
@@ -208,11 +282,33 @@ class ManhattanDistance(Distance):
         Returns:
             FloatTensor: Pairwise distance tensor.
         """
-        x_rs = tf.reshape(embeddings, shape=[tf.shape(embeddings)[0], -1])
-        deltas = tf.expand_dims(x_rs, axis=1) - tf.expand_dims(x_rs, axis=0)
-        distances: FloatTensor = tf.norm(deltas, 1, axis=2)
+        num_rows = tf.shape(embeddings)[0]
+
+        def _pairwise_distances() -> FloatTensor:
+            # pad the rows so they split evenly into blocks of block_size.
+            padding = -num_rows % self.block_size
+            blocks = tf.pad(embeddings, [[0, padding], [0, 0]])
+            blocks = tf.reshape(
+                blocks, [-1, self.block_size, tf.shape(embeddings)[1]])
+
+            # one block at a time: concurrent iterations would each hold
+            # their own [block_size, N, D] deltas.
+            distances: FloatTensor = tf.map_fn(
+                lambda block: _manhattan_block(block, embeddings),
+                blocks,
+                parallel_iterations=1)
+            distances = tf.reshape(distances, [-1, num_rows])[:num_rows]
+            return distances
+
+        # map_fn can't stack an empty set of blocks.
+        distances: FloatTensor = tf.cond(
+            num_rows > 0, _pairwise_distances,
+            lambda: tf.zeros([0, 0], dtype=embeddings.dtype))
         return distances
 
+    def get_config(self):
+        return {'block_size': self.block_size}
+
 
 # List of implemented distances
 DISTANCES = [
@@ -223,6 +319,14 @@ DISTANCES = [
     CosineDistance()
 ]
 
+# name and aliases lookups, built once at import time.
+_NAME2FN = {distance.name: distance for distance in DISTANCES}
+_ALIAS_MAP = {
+    alias: distance.name
+    for distance in DISTANCES
+    for alias in [distance.name, *distance.aliases]
+}
+
 
 def distance_canonicalizer(user_distance: Union[Distance, str]) -> Distance:
     """Normalize user requested distance to its matching Distance object.
@@ -239,24 +343,11 @@ def distance_canonicalizer(user_distance: Union[Distance, str]) -> Distance:
         # user supplied distance function
         return user_distance
 
-    mapping = {}
-    name2fn = {}
-    for distance in DISTANCES:
-        # self reference
-        mapping[distance.name] = distance.name
-        name2fn[distance.name] = distance
-        # aliasing
-        for alias in distance.aliases:
-            mapping[alias] = distance.name
-
     if isinstance(user_distance, str):
-        user_distance = user_distance.lower().strip()
-        if user_distance in mapping:
-            user_distance = mapping[user_distance]
-        else:
-            raise ValueError('Metric not supported by the framework')
-
-        return name2fn[user_distance]
+        try:
+            return _NAME2FN[_ALIAS_MAP[user_distance.lower().strip()]]
+        except KeyError:
+            raise ValueError('Metric not supported by the framework') from None
 
     raise ValueError('Unknown distance: must either be a MetricDistance\
                      or a known distance function')
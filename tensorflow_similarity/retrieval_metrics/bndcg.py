@@ -144,13 +144,13 @@ class BNDCG(RetrievalMetric):
         if self.average == "micro":
             ndcg = tf.math.reduce_mean(per_example_ndcg)
         elif self.average == "macro":
-            per_class_metrics = 0
-            class_labels = tf.unique(query_labels)[0]
-            for label in class_labels:
-                idxs = tf.where(query_labels == label)
-                c_slice = tf.gather(per_example_ndcg, indices=idxs)
-                per_class_metrics += tf.math.reduce_mean(c_slice)
-            ndcg = tf.math.divide(per_class_metrics, len(class_labels))
+            class_labels, class_idxs = tf.unique(query_labels)
+            per_class_metrics = tf.math.unsorted_segment_mean(
+                per_example_ndcg,
+                class_idxs,
+                num_segments=tf.shape(class_labels)[0],
+            )
+            ndcg = tf.math.reduce_mean(per_class_metrics)
         else:
             raise ValueError(
                 f"{self.average} is not a supported average " "option"
@@ -91,13 +91,13 @@ class PrecisionAtK(RetrievalMetric):
         if self.average == "micro":
             p_at_k = tf.math.reduce_mean(per_example_p)
         elif self.average == "macro":
-            per_class_metrics = 0
-            class_labels = tf.unique(query_labels)[0]
-            for label in class_labels:
-                idxs = tf.where(query_labels == label)
-                c_slice = tf.gather(per_example_p, indices=idxs)
-                per_class_metrics += tf.math.reduce_mean(c_slice)
-            p_at_k = tf.math.divide(per_class_metrics, len(class_labels))
+            class_labels, class_idxs = tf.unique(query_labels)
+            per_class_metrics = tf.math.unsorted_segment_mean(
+                per_example_p,
+                class_idxs,
+                num_segments=tf.shape(class_labels)[0],
+            )
+            p_at_k = tf.math.reduce_mean(per_class_metrics)
         else:
             raise ValueError(
                 f"{self.average} is not a supported average " "option"
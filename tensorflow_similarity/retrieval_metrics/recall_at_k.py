@@ -73,21 +73,24 @@ class RecallAtK(RetrievalMetric):
         """
         self._check_shape(query_labels, match_mask)
 
-        k_slice = match_mask[:, : self.k]
-        match_indicator = tf.math.reduce_any(k_slice, axis=1)
+        if self.k == 1:
+            # the first neighbor is the whole slice, no reduction needed.
+            match_indicator = match_mask[:, 0]
+        else:
+            k_slice = match_mask[:, : self.k]
+            match_indicator = tf.math.reduce_any(k_slice, axis=1)
         match_indicator = tf.cast(match_indicator, dtype="float")
 
         if self.average == "micro":
             recall_at_k = tf.math.reduce_mean(match_indicator)
         elif self.average == "macro":
-            per_class_metrics = 0
-            class_labels = tf.unique(query_labels)[0]
-            # TODO(ovallis): potential slowness.
-            for label in class_labels:
-                idxs = tf.where(query_labels == label)
-                c_slice = tf.gather(match_indicator, indices=idxs)
-                per_class_metrics += tf.math.reduce_mean(c_slice)
-            recall_at_k = tf.math.divide(per_class_metrics, len(class_labels))
+            class_labels, class_idxs = tf.unique(query_labels)
+            per_class_metrics = tf.math.unsorted_segment_mean(
+                match_indicator,
+                class_idxs,
+                num_segments=tf.shape(class_labels)[0],
+            )
+            recall_at_k = tf.math.reduce_mean(per_class_metrics)
         else:
             raise ValueError(
                 f"{self.average} is not a supported average " "option"
@@ -32,3 +32,24 @@ def test_compute(avg, expected):
 
     precision = rm.compute(query_labels=query_labels, match_mask=match_mask)
     np.testing.assert_allclose(precision, expected)
+
+
+def test_compute_macro_unbalanced():
+    query_labels = tf.constant([2, 0, 2, 1, 2, 0])
+    match_mask = tf.constant(
+        [
+            [True, False],
+            [False, False],
+            [False, False],
+            [True, True],
+            [True, True],
+            [True, False],
+        ],
+        dtype=bool,
+    )
+    rm = PrecisionAtK(k=2, average="macro")
+
+    precision = rm.compute(query_labels=query_labels, match_mask=match_mask)
+    # per class precision: 0 -> 1/4, 1 -> 1, 2 -> 1/2
+    expected = (0.25 + 1.0 + 0.5) / 3.0
+    np.testing.assert_allclose(precision, expected, rtol=1e-6)
@@ -31,3 +31,43 @@ def test_compute(avg, expected):
 
     recall = rm.compute(query_labels=query_labels, match_mask=match_mask)
     assert recall == expected
+
+
+@pytest.mark.parametrize("avg, expected", [("micro", 0.5), ("macro", 0.5)],
+                         ids=["micro", "macro"])
+def test_compute_k1(avg, expected):
+    query_labels = tf.constant([1, 1, 0, 0])
+    match_mask = tf.constant(
+        [
+            [True, False],
+            [False, True],
+            [True, True],
+            [False, True],
+        ],
+        dtype=bool,
+    )
+    rm = RecallAtK(k=1, average=avg)
+
+    recall = rm.compute(query_labels=query_labels, match_mask=match_mask)
+    assert recall == tf.constant(expected)
+
+
+def test_compute_macro_unbalanced():
+    query_labels = tf.constant([2, 0, 2, 1, 2, 0])
+    match_mask = tf.constant(
+        [
+            [True, False],
+            [False, False],
+            [False, False],
+            [False, True],
+            [True, True],
+            [True, False],
+        ],
+        dtype=bool,
+    )
+    rm = RecallAtK(k=2, average="macro")
+
+    recall = rm.compute(query_labels=query_labels, match_mask=match_mask)
+    # per class recall: 0 -> 1/2, 1 -> 1, 2 -> 2/3
+    expected = (0.5 + 1.0 + 2.0 / 3.0) / 3.0
+    assert recall.numpy() == pytest.approx(expected)
@@ -3,9 +3,11 @@ import tensorflow as tf
 import numpy as np
 from tensorflow_similarity.distances import CosineDistance, InnerProductSimilarity
 from tensorflow_similarity.distances import EuclideanDistance
+from tensorflow_similarity.distances import SquaredEuclideanDistance
 from tensorflow_similarity.distances import ManhattanDistance
 from tensorflow_similarity.distances import distance_canonicalizer
 from tensorflow_similarity.distances import DISTANCES
+from tensorflow_similarity.distances import Distance
 
 
 def test_distance_mapping():
@@ -28,9 +30,43 @@ def test_distance_passthrough():
     assert d == d2
 
 
+def test_distance_equality():
+    d = distance_canonicalizer('l2')
+    assert d is distance_canonicalizer('euclidean')
+    assert d == EuclideanDistance()
+    assert hash(d) == hash(EuclideanDistance())
+    assert d != SquaredEuclideanDistance()
+    assert d != EuclideanDistance(compute_dtype='bfloat16')
+    assert len({d, EuclideanDistance(), CosineDistance()}) == 2
+
+
+class ScaledDistance(Distance):
+    "Distance with state that get_config() doesn't report"
+    def __init__(self, scale):
+        super().__init__('scaled')
+        self.scale = scale
+
+    @tf.function
+    def call(self, embeddings):
+        return self.scale * tf.reduce_sum(embeddings, axis=1)
+
+
+def test_distance_equality_distinct_state():
+    a = tf.ones((1, 2))
+    d1 = ScaledDistance(1.0)
+    d100 = ScaledDistance(100.0)
+    assert d1 != d100
+    assert d1 == ScaledDistance(1.0)
+    assert d1.call is not d100.call
+    assert d1(a) == 2.0
+    assert d100(a) == 200.0
+
+
 def test_non_existing_distance():
-    with pytest.raises(ValueError):
+    with pytest.raises(ValueError) as excinfo:
         distance_canonicalizer('notadistance')
+    assert excinfo.value.__cause__ is None
+    assert excinfo.value.__suppress_context__
 
 
 def angular_distance_np(feature):
@@ -73,6 +109,24 @@ def test_cosine_vals():
     assert vals[0][1] == 0.31861484
 
 
+def test_bfloat16_compute_dtype():
+    a = tf.nn.l2_normalize(tf.random.uniform((8, 16)), axis=-1)
+    for cls in [CosineDistance, EuclideanDistance, SquaredEuclideanDistance,
+                InnerProductSimilarity]:
+        expected = cls()(a)
+        vals = cls(compute_dtype='bfloat16')(a)
+        assert vals.dtype == tf.float32
+        assert np.allclose(vals, expected, atol=5e-2)
+
+    # duplicated embeddings must stay at a zero distance in reduced precision
+    # (the squared norm 1.01 rounds to 1.0078125 in bfloat16).
+    dup = tf.constant([[1.0, 0.1], [0.0, 1.0], [1.0, 0.1]])
+    vals = EuclideanDistance(compute_dtype='bfloat16')(dup)
+    assert vals[0][0] == 0
+    assert vals[0][2] == 0
+    assert np.allclose(vals[0][1], np.sqrt(1.81), atol=5e-2)
+
+
 def test_euclidean():
     a = tf.convert_to_tensor([[0.0, 3.0], [4.0, 0.0]])
     d = EuclideanDistance()
@@ -126,8 +180,52 @@ def test_manhattan_opposite():
     assert tf.round(tf.reduce_sum(vals)) == 4
 
 
+def test_manhattan_blocks():
+    "Rows not evenly divisible by the block size must still be computed"
+    a = np.random.uniform(size=(11, 4)).astype('float32')
+    d = ManhattanDistance(block_size=4)
+    vals = d(tf.convert_to_tensor(a))
+    expected = np.sum(np.abs(a[:, None, :] - a[None, :, :]), axis=2)
+    assert vals.shape == (11, 11)
+    assert np.allclose(vals, expected)
+
+
+def test_manhattan_empty():
+    "An empty batch must return an empty distance matrix, even once relaxed"
+    d = ManhattanDistance()
+    for num_rows in [3, 5, 0]:
+        vals = d(tf.zeros((num_rows, 4)))
+        assert vals.shape == (num_rows, num_rows)
+
+
+def test_manhattan_blocks_gradient():
+    a = tf.Variable(np.random.uniform(size=(11, 4)).astype('float32'))
+    d = ManhattanDistance(block_size=4)
+    with tf.GradientTape() as tape:
+        loss = tf.reduce_sum(tf.square(d(a)))
+    grad = tape.gradient(loss, a)
+
+    with tf.GradientTape() as tape:
+        deltas = tf.expand_dims(a, axis=1) - tf.expand_dims(a, axis=0)
+        expected = tf.reduce_sum(tf.abs(deltas), axis=2)
+        loss = tf.reduce_sum(tf.square(expected))
+    expected_grad = tape.gradient(loss, a)
+    assert np.allclose(grad, expected_grad, atol=1e-5)
+
+
 def test_innerprod():
     a = [[1, 2, 3], [1, 3, 3]]
     d = InnerProductSimilarity()
     vals = d(a)
     assert tf.round(tf.reduce_sum(vals)) == 65
+
+
+@pytest.mark.parametrize("distance", DISTANCES, ids=str)
+def test_no_retrace_on_batch_size(distance):
+    # a fresh subclass never compares equal to the DISTANCES singleton, so
+    # the instance gets its own tf.function trace cache.
+    d = type('Fresh', (type(distance),), {})()
+    assert d.call.experimental_get_tracing_count() == 0
+    for batch_size in [4, 8, 16, 32]:
+        d(tf.random.uniform((batch_size, 3)))
+    assert d.call.experimental_get_tracing_count() <= 2